@@ -19,12 +19,16 @@ Note
 pycaw.magic needs to be imported before any other pycaw or comtypes import.
 """
 
+import logging
 import os
+import sys
+import weakref
 from contextlib import suppress
 # _____ ADVANCED WINDOWS COMMUNICATION _____
 from ctypes import windll
+from queue import Empty, SimpleQueue
 # ____________ GUI WITH TKINTER ____________
-from tkinter import BOTTOM, HORIZONTAL, DoubleVar, StringVar, Tk
+from tkinter import BOTTOM, HORIZONTAL, Canvas, IntVar, Tk
 from tkinter.ttk import Button, Frame, Label, Scale, Separator, Style
 
 from pycaw.magic import MagicManager, MagicSession  # isort:skip
@@ -37,11 +41,62 @@ windll.shcore.SetProcessDpiAwareness(2)
 # started and adjusts the scale factor whenever the DPI changes.
 # Normally tkinter apps are not automatically scaled.
 
+# ______________ DEBUG OUTPUT ______________
+# set MSM_DEBUG to log every session event to the console (see main)
+logger = logging.getLogger(__name__)
+
+
+def _q(volume):
+    """ volume scalar in integer units, for float noise free comparison """
+    return int(round(volume * 10000))
+
+
+# ________________ STYLING ________________
+MUTED_STYLE = "Muted.TButton"
+UNMUTED_STYLE = "Unmuted.TButton"
+
+# session status bar colors
+ACTIVE_COLOR = '#007AD9'
+# INACTIVE_COLOR = '#A2A2A2'
+INACTIVE_COLOR = '#AF3118'
+EXPIRED_COLOR = ''  # transparent
+
+
+def _init_styles():
+    """ configure the shared ttk styles, only once per process """
+    if getattr(_init_styles, 'done', False):
+        return
+    s = Style()
+
+    s.configure(UNMUTED_STYLE, foreground='#007AD9')
+    # s.configure(MUTED_STYLE, foreground='#C33C54')
+    s.configure(MUTED_STYLE, foreground='#AF3118')
+    _init_styles.done = True
+
 
 class RootFrame(Tk):
     """Mixer Window"""
+
+    # poll interval (ms) and max events handled per poll of the event queue
+    DRAIN_INTERVAL = 10
+    DRAIN_BATCH = 256
+
     def __init__(self):
         super().__init__()
+        # __________ SESSION EVENT QUEUE __________
+        # pycaw callbacks come from a com thread and must not touch tk:
+        # they only put (row_id, kind, value) here, the tk thread drains it
+        # (kind "build" creates the row's widgets, see AppRow.__init__)
+        self.event_q = SimpleQueue()
+        # id(magic_root_session) -> AppRow, rows drop out once collected
+        self.rows = weakref.WeakValueDictionary()
+        # rows of the initial session enumeration are displayed together
+        # (see add_row / end_bulk_add)
+        self._bulk_add = True
+        self._bulk_rows = []
+        # one tcl command shared by all volume sliders (see _on_slide)
+        self._dispatch = self.register(self._on_slide)
+
         # __________ ROOT WINDOW MENU BAR __________
         self.geometry("500x600")
         self.title("Magic Session Mixer")
@@ -51,15 +106,7 @@ class RootFrame(Tk):
         self.iconbitmap(icon_path)
 
         # ________________ STYLING ________________
-        s = Style()
-
-        s.configure("Active.TFrame", background='#007AD9')
-        # s.configure("Inactive.TFrame", background='#A2A2A2')
-        s.configure("Inactive.TFrame", background='#AF3118')
-
-        s.configure("Unmuted.TButton", foreground='#007AD9')
-        # s.configure("Muted.TButton", foreground='#C33C54')
-        s.configure("Muted.TButton", foreground='#AF3118')
+        _init_styles()
 
         # _________________ HEADER _________________
         header = Frame(self)
@@ -82,6 +129,79 @@ class RootFrame(Tk):
                              font=("Consolas", 8, "italic"))
         turbo_anonym.pack(side=BOTTOM, fill="x", pady=6, padx=6)
 
+        # _______________ SESSION ROWS _______________
+        # rows are gridded into fixed slots: adding one doesn't
+        # reflow all of its siblings like pack does
+        self.rows_frame = Frame(self)
+        self.rows_frame.columnconfigure(0, weight=1)
+        self.rows_frame.pack(fill='both', expand=True)
+        self._next_row = 0
+
+        # ___________ START QUEUE POLLING ___________
+        self.after(self.DRAIN_INTERVAL, self._drain)
+
+    def add_row(self, row):
+        """ display a built AppRow, deferred during the initial burst """
+        if self._bulk_add:
+            self._bulk_rows.append(row)
+        else:
+            row._place()
+
+    def end_bulk_add(self):
+        """ display all rows of the initial burst with a single relayout """
+        self._bulk_add = False
+        rows, self._bulk_rows = self._bulk_rows, []
+        for row in rows:
+            # rows of sessions that already expired are skipped
+            if row._built:
+                row._place()
+        self.update_idletasks()
+
+    def _on_slide(self, row_id, value):
+        """ volume slider command of every row, called with the row id """
+        row = self.rows.get(int(row_id))
+        if row is None:
+            return
+        row._slide_volume(value)
+
+    def _drain(self):
+        """
+        apply queued session events on the tk thread
+        every row is only redrawn once per poll with its latest values
+        """
+        try:
+            touched = {}
+            for _ in range(self.DRAIN_BATCH):
+                try:
+                    row_id, kind, value = self.event_q.get_nowait()
+                except Empty:
+                    break
+                if kind == "end_bulk_add":
+                    # queued by main after the initial session enumeration
+                    self.end_bulk_add()
+                    continue
+                row = self.rows.get(row_id)
+                if row is None:
+                    continue
+                if kind == "build":
+                    try:
+                        row._build_widgets()
+                    except Exception:
+                        self.report_callback_exception(*sys.exc_info())
+                    continue
+                row._pending[kind] = value
+                touched[row_id] = row
+
+            # an error in one row must not keep the others from updating
+            for row in touched.values():
+                try:
+                    row._flush()
+                except Exception:
+                    self.report_callback_exception(*sys.exc_info())
+        finally:
+            # keep polling, whatever happened above
+            self.after(self.DRAIN_INTERVAL, self._drain)
+
 
 class AppRow(MagicSession, Frame):
     """
@@ -90,20 +210,64 @@ class AppRow(MagicSession, Frame):
     handles user input and changing session volume/mute.
     """
 
+    # trailing delay (ms) before a slider drag is written to the session
+    VOLUME_DEBOUNCE = 30
+
+    # session states as plain ints, pycaw may report them as such
+    _S_INACTIVE = int(AudioSessionState.Inactive)
+    _S_ACTIVE = int(AudioSessionState.Active)
+    _S_EXPIRED = int(AudioSessionState.Expired)
+
+    # status bar color per session state
+    _STATE_COLOR = {_S_INACTIVE: INACTIVE_COLOR,
+                    _S_ACTIVE: ACTIVE_COLOR,
+                    _S_EXPIRED: EXPIRED_COLOR}
+
     def __init__(self, root_frame_instance):
+        self.root_frame_instance = root_frame_instance
+
+        # ___________ PENDING GUI UPDATES ___________
+        # latest value per attribute, applied by RootFrame._drain
+        self._pending = {}
+        # pending debounced volume write (see _slide_volume)
+        self._vol_after_id = None
+        # last mute/state seen, pycaw re-emits unchanged values
+        self._last_mute = None
+        self._last_state = None
+        # widgets are created later on the tk thread (see _build_widgets)
+        self._built = False
+        # events queued before registration below are dropped by _drain
+        self.row_id = None
+        # set below, callbacks may log it before that
+        self.app_name = None
+
         super().__init__(volume_callback=self.update_volume,
                          mute_callback=self.update_mute,
                          state_callback=self.update_state)
 
-        self.root_frame_instance = root_frame_instance
+        self.row_id = id(self.magic_root_session)
+        root_frame_instance.rows[self.row_id] = self
 
         # ______________ DISPLAY NAME ______________
         self.app_name = self.magic_root_session.app_exec
 
-        print(f":: new session: {self.app_name}")
+        logger.info(":: new session: %s", self.app_name)
+
+        # ____________ INITIAL SESSION DATA ____________
+        # newer values from callbacks take precedence
+        self._pending.setdefault("volume", self.volume)
+        self._last_mute = self._pending.setdefault("mute", self.mute)
+        self._last_state = self._pending.setdefault("state", self.state)
+
+        # don't block the session callback with widget creation
+        # and leave it to the tk thread (see RootFrame._drain):
+        root_frame_instance.event_q.put_nowait((self.row_id, "build", None))
+
+    def _build_widgets(self):
+        """ create and display the row, then apply the pending session data """
         # ______________ CREATE FRAME ______________
         # super(MagicSession, self).__init__(root_frame_instance)
-        Frame.__init__(self, root_frame_instance)
+        Frame.__init__(self, self.root_frame_instance.rows_frame)
 
         # _______________ NAME LABEL _______________
         self.name_label = Label(self,
@@ -111,36 +275,37 @@ class AppRow(MagicSession, Frame):
                                 font=("Consolas", 12, "italic"))
 
         # _____________ VOLUME SLIDER _____________
-        self.volume_slider_state = DoubleVar()
+        # whole percent: short tcl strings, no float repr per update
+        self.volume_slider_state = IntVar()
 
         self.volume_slider = Scale(self,
                                    variable=self.volume_slider_state,
-                                   command=self._slide_volume,
+                                   command=(self.root_frame_instance._dispatch,
+                                            self.row_id),
                                    from_=0, to=100,
                                    takefocus=False,
                                    orient=HORIZONTAL)
 
-        # set initial:
-        self.volume_slider_state.set(self.volume * 100)
-
         # ______________ MUTE BUTTON ______________
-
-        self.mute_button_state = StringVar()
-
         self.mute_button = Button(self,
                                   style="",
-                                  textvariable=self.mute_button_state,
+                                  text="🔊",
                                   command=self._toogle_mute,
                                   takefocus=False)
 
-        # set initial:
-        self.update_mute(self.mute)
-
         # _____________ SESSION STATUS _____________
-        self.status_line = Frame(self, style="", width=6)
-
-        # set initial:
-        self.update_state(self.state)
+        # a plain canvas rectangle is much cheaper to recolor
+        # than a themed ttk frame
+        self._status_canvas = Canvas(self, width=6, height=1,
+                                     highlightthickness=0)
+        self._status_rect = self._status_canvas.create_rectangle(
+            0, 0, 6, 999, fill=EXPIRED_COLOR, outline='')
+
+        # ___________ CACHED TCL ACCESS ___________
+        # the update path calls tcl directly, skipping the tkinter wrappers
+        self._tkcall = self.tk.call
+        self._vol_varname = str(self.volume_slider_state)
+        self._status_w = str(self._status_canvas)
 
         # ________________ SEPARATE ________________
         self.separate = Separator(self, orient=HORIZONTAL)
@@ -155,87 +320,187 @@ class AppRow(MagicSession, Frame):
         self.mute_button.grid(row=1, column=0)
         self.volume_slider.grid(row=1, column=1, sticky="EW", pady=10, padx=20)
         self.separate.grid(row=2, column=0, columnspan=3, sticky="EW", pady=10)
-        self.status_line.grid(row=0, rowspan=2, column=2, sticky="NS")
+        self._status_canvas.grid(row=0, rowspan=2, column=2, sticky="NS")
 
         # _____________ DISPLAY FRAME _____________
-        self.pack(pady=0, padx=15, fill='x')
+        self.root_frame_instance.add_row(self)
+
+        # set initial (and everything received while building):
+        self._built = True
+        self._flush()
+
+    def _place(self):
+        """ put the row into the next free slot of the mixer window """
+        root = self.root_frame_instance
+        self.grid(row=root._next_row, column=0, sticky="EW", padx=15)
+        root._next_row += 1
 
     def update_volume(self, new_volume):
         """
         when volume is changed externally
         (see callback -> AudioSessionEvents -> OnSimpleVolumeChanged )
         """
-        # compare if the windows callback is because we set the slider:
-        # if so drop update since we made the change
-        # and all is already up to date - this will prevent lagg
-        print(f"{self.app_name} volume: {new_volume}")
-        self.volume_slider_state.set(new_volume*100)
+        # changes we made through the slider don't arrive here:
+        # pycaw writes with our session guid and filters them out
+        logger.debug("%s volume: %s", self.app_name, new_volume)
+        self.root_frame_instance.event_q.put_nowait(
+            (self.row_id, "volume", new_volume))
 
     def update_mute(self, new_mute):
         """ when mute state is changed by user or through other app """
-        if new_mute:
-            icon = "🔈"
-            self.mute_button.configure(style="Muted.TButton")
-        else:
-            icon = "🔊"
-            self.mute_button.configure(style="Unmuted.TButton")
+        if new_mute == self._last_mute:
+            return
+        self._last_mute = new_mute
 
-        # .set is a method of tkinters variables
-        # it will change the button text
-        print(f"{self.app_name} mute: {icon}")
-        self.mute_button_state.set(icon)
+        self.root_frame_instance.event_q.put_nowait(
+            (self.row_id, "mute", new_mute))
 
     def update_state(self, new_state):
         """
         when status changed
         (see callback -> AudioSessionEvents -> OnStateChanged)
         """
-        print(f"{self.app_name} state: {new_state}")
-        if new_state == AudioSessionState.Inactive:
-            # AudioSessionStateInactive
-            self.status_line.configure(style="Inactive.TFrame")
-
-        elif new_state == AudioSessionState.Active:
-            # AudioSessionStateActive
-            self.status_line.configure(style="Active.TFrame")
-
-        elif new_state == AudioSessionState.Expired:
-            # AudioSessionStateExpired
-            self.status_line.configure(style="TFrame")
+        if new_state == self._last_state:
+            return
+        self._last_state = new_state
+
+        logger.debug("%s state: %s", self.app_name, new_state)
+        self.root_frame_instance.event_q.put_nowait(
+            (self.row_id, "state", new_state))
+
+    def _flush(self):
+        """ apply only the most recent value of each pending attribute """
+        if not self._built:
+            # keep them, _build_widgets will replay them
+            return
+        pending, self._pending = self._pending, {}
+
+        if "volume" in pending:
+            self._tkcall('set', self._vol_varname,
+                         int(round(pending["volume"]*100)))
+        if "mute" in pending:
+            self._show_mute(pending["mute"])
+        if "state" in pending:
+            self._show_state(pending["state"])
+
+    def _show_mute(self, new_mute):
+        """ display mute state on the mute button """
+        if new_mute:
+            icon = "🔈"
+            self.mute_button['style'] = MUTED_STYLE
+        else:
+            icon = "🔊"
+            self.mute_button['style'] = UNMUTED_STYLE
+
+        logger.debug("%s mute: %s", self.app_name, icon)
+        self.mute_button['text'] = icon
+
+    def _show_state(self, new_state):
+        """ display session state on the status bar """
+        s = int(new_state)
+        color = self._STATE_COLOR.get(s)
+        if color is not None:
+            self._status_configure(color)
+
+        if s == self._S_EXPIRED:
             """when session expires"""
-            print(f":: closed session: {self.app_name}")
-            self.destroy()
+            logger.info(":: closed session: %s", self.app_name)
+            self._teardown()
+
+    def _status_configure(self, color):
+        """ recolor the status bar """
+        self._tkcall(self._status_w, 'itemconfigure',
+                     self._status_rect, '-fill', color)
+
+    def _teardown(self):
+        """
+        free the row when its session expired
+        drops everything that could keep the widget tree alive
+        """
+        if self._vol_after_id is not None:
+            self.after_cancel(self._vol_after_id)
+            self._vol_after_id = None
+
+        # pycaw may still hold on to the session and its callbacks:
+        self.volume_callback = self.mute_callback = self.state_callback = None
+
+        # RootFrame.rows forgets the row on its own once it is collected,
+        # until then _flush ignores events for it
+        self._built = False
+        del self.volume_slider_state
+        self.destroy()
 
     def _slide_volume(self, value):
         """ when slider moved by user """
-        new_volume = float(value)/100
+        if self.magic_root_session is None:
+            # expired, pycaw already removed the session
+            return
+        # ttk hands over float strings even with an IntVar
+        new_volume = round(float(value))/100
+        # the slider fires on every pixel, only write the final value:
+        # drop a pending write first, it is outdated either way
+        if self._vol_after_id is not None:
+            self.after_cancel(self._vol_after_id)
+            self._vol_after_id = None
         # check if new user value really is new: (ttk bug)
-        if self.volume != new_volume:
+        if _q(new_volume) != _q(self.volume):
             # since self.volume is true data through windows
-            # it will generally differ, but 1.0 == 1
-            print(f"with pycaw: {self.app_name} volume: {new_volume}")
-            self.volume = new_volume
+            # it will generally differ, compare in scaled integer units
+            self._vol_after_id = self.after(self.VOLUME_DEBOUNCE,
+                                            self._write_volume, new_volume)
+
+    def _write_volume(self, new_volume):
+        """ write the debounced slider volume to the session """
+        self._vol_after_id = None
+        if self.magic_root_session is None:
+            # expired before the write was due
+            return
+        logger.debug("with pycaw: %s volume: %s", self.app_name, new_volume)
+        self.volume = new_volume
 
     def _toogle_mute(self):
         """ when mute button pressed """
+        if self.magic_root_session is None:
+            # expired, pycaw already removed the session
+            return
         new_mute = self.toggle_mute()
 
         self.update_mute(new_mute)
 
 
 def main():
-    # ___________ CREATE ROOT WINDOW ___________
-    root_frame_instance = RootFrame()
-
-    # ________ START THE MAGIC ________
-    # args and kwargs are passed
-    MagicManager.magic_session(AppRow, root_frame_instance)
-
-    # ______________ START WINDOW ______________
-    with suppress(KeyboardInterrupt):
-        root_frame_instance.mainloop()
-
-    print("\nTschüss")
+    # plain writes to stderr (like the goodbye) don't need line buffering
+    # there is no stderr under pythonw and no reconfigure in idle
+    reconfigure = getattr(sys.stderr, "reconfigure", None)
+    if reconfigure is not None:
+        reconfigure(write_through=False, line_buffering=False)
+
+    if os.environ.get('MSM_DEBUG'):
+        logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+
+    # _________ TIMER RESOLUTION _________
+    windll.winmm.timeBeginPeriod(1)
+    # the default system timer interval is 15.6 ms, far coarser than
+    # the event queue poll and slider debounce timers.
+    # 1 ms is requested while the mixer runs and always released again.
+    try:
+        # ___________ CREATE ROOT WINDOW ___________
+        root_frame_instance = RootFrame()
+
+        # ________ START THE MAGIC ________
+        # args and kwargs are passed
+        MagicManager.magic_session(AppRow, root_frame_instance)
+        # the queue is drained in order: this runs after the rows are built
+        root_frame_instance.event_q.put_nowait((None, "end_bulk_add", None))
+
+        # ______________ START WINDOW ______________
+        with suppress(KeyboardInterrupt):
+            root_frame_instance.mainloop()
+    finally:
+        windll.winmm.timeEndPeriod(1)
+
+    if sys.stderr is not None:
+        sys.stderr.write("\nTschüss\n")
 
 
 if __name__ == '__main__':